@@ -2,10 +2,11 @@
 Provides a Linear Operator for the Curvelet transform to interface with PyLops.
 """
 
+import operator
 import pyct as ct
 import numpy as np
 from pylops import LinearOperator
-from itertools import product
+from functools import lru_cache, reduce
 
 
 def _fdct_docs(dimension):
@@ -39,7 +40,17 @@ def _fdct_docs(dimension):
             If ``False``, a wavelet transform will be used for the
             coarsest scale.
         dtype : :obj:`str`, optional
-            Type of the transform
+            Type of the transform. Real types use the real-valued transform
+            and complex types the complex-valued one. CurveLab always
+            computes in double precision, but single precision types
+            (``float32``, ``complex64``) halve the memory of the
+            coefficients returned by the operator.
+        copy : :obj:`bool`, optional
+            Return a new array from every forward and adjoint call. If
+            ``False``, the output and intermediate buffers are allocated
+            once and reused, so the result of a call is overwritten by the
+            next call of the same kind, and the operator must not be
+            called from several threads at once.
 
         Attributes
         ----------
@@ -51,11 +62,42 @@ def _fdct_docs(dimension):
         """
 
 
+def _prod(iterable):
+    """Product of Python integers, avoiding NumPy overhead on tiny shapes"""
+    return reduce(operator.mul, iterable, 1)
+
+
+@lru_cache(maxsize=8)
+def _get_plan(ctfdct, input_shape, nbscales, nbangles_coarse, allcurvelets,
+              cpx):
+    """CurveLab plan memoized across operators with the same configuration
+
+    Operators built with the same parameters share their plan.
+    """
+    return ctfdct(list(input_shape), nbscales, nbangles_coarse,
+                  allcurvelets, norm=False, cpx=cpx)
+
+
+def _fwd_batch(plan, x_batch, out):
+    """Forward transform each slice of ``x_batch`` into a row of ``out``"""
+    fwd = plan.fwd
+    for i in range(len(x_batch)):
+        out[i] = fwd(x_batch[i])
+
+
+def _inv_batch(plan, x_batch, out):
+    """Inverse transform each row of ``x_batch`` into a slice of ``out``"""
+    inv = plan.inv
+    shape = out.shape[1:]
+    for i in range(len(x_batch)):
+        out[i] = inv(x_batch[i]).reshape(shape)
+
+
 class FDCT(LinearOperator):
     __doc__ = _fdct_docs(0)
 
     def __init__(self, dims, dirs, nbscales=None, nbangles_coarse=16,
-                 allcurvelets=True, dtype='complex128'):
+                 allcurvelets=True, dtype='complex128', copy=True):
         # Check dimension
         if len(dirs) == 2:
             ctfdct = ct.fdct2
@@ -63,11 +105,23 @@ class FDCT(LinearOperator):
             ctfdct = ct.fdct3
         else:
             raise NotImplementedError("FDCT is only implemented in 2D or 3D")
+        self._build_plan(ctfdct, dims, dirs, nbscales, nbangles_coarse,
+                         allcurvelets, dtype, copy)
 
+    def _build_plan(self, ctfdct, dims, dirs, nbscales, nbangles_coarse,
+                    allcurvelets, dtype, copy):
+        # Shared construction for FDCT, FDCT2D and FDCT3D once the CurveLab
+        # transform ctfdct matching len(dirs) is known
         ndim = len(dims)
 
         # Ensure directions are between 0, ndim-1
-        dirs = [np.core.multiarray.normalize_axis_index(d, ndim) for d in dirs]
+        dirs = [operator.index(d) for d in dirs]
+        if not all(-ndim <= d < ndim for d in dirs):
+            raise ValueError(
+                f"dirs {tuple(dirs)} out of bounds for {ndim} dimensions")
+        dirs = [d % ndim for d in dirs]
+        if len(set(dirs)) != len(dirs):
+            raise ValueError("dirs must not contain repeated directions")
 
         # If input is shaped (100, 200, 300) and dirs = (0, 2)
         # then input_shape will be (100, 300)
@@ -76,33 +130,49 @@ class FDCT(LinearOperator):
             nbscales = int(np.ceil(np.log2(min(self._input_shape_2d)) - 3))
 
         # Complex operator is required to handle complex input
-        dtype = np.dtype(dtype)
-        if np.issubdtype(dtype, np.complexfloating):
-            cpx = True
-        else:
-            cpx = False
-
-        # We have enough info to create the operator
-        self.FDCT = ctfdct(list(self._input_shape_2d),
-                           nbscales, nbangles_coarse, allcurvelets,
-                           norm=False, cpx=cpx)
+        self.dtype = np.dtype(dtype)
+        cpx = np.issubdtype(self.dtype, np.complexfloating)
+        # CurveLab only takes double precision inputs, so single precision
+        # operators cast their input before handing it to the plan
+        plan_dtype = np.dtype(np.complex128 if cpx else np.float64)
+        cast_dtype = None if self.dtype == plan_dtype else plan_dtype
 
-        # Now we need to build the iterator which will only iterate along
-        # the required directions. Following the example above,
+        # Now we need to find the axes which will be iterated over, i.e.,
+        # those not in the required directions. Following the example above,
         # iterable_axes = [ False, True, False ]
         iterable_axes = [False if i in dirs else True for i in range(ndim)]
-        ndim_iterable = np.prod(np.array(dims)[iterable_axes])
+        n_slices = _prod(dims[ax] for ax, doiter in
+                         enumerate(iterable_axes) if doiter)
+
+        # We have enough info to create the operator
+        self.FDCT = _get_plan(ctfdct, tuple(self._input_shape_2d),
+                              nbscales, nbangles_coarse, allcurvelets, cpx)
 
-        # Build the iterator itself. In our example, the slices
-        # would be [:, i, :] for i in range(200)
-        # We use slice(None) is the colon operator
-        self._iterator = list(product(
-            *(range(dims[ax]) if doiter else [slice(None)]
-                for ax, doiter in enumerate(iterable_axes))))
+        # Transposing the iterable axes to the front makes each slice a
+        # contiguous block of memory. In our example, the input is
+        # transposed to (200, 100, 300). All iterable axes are then
+        # collapsed into one, so that the slices [:, i, :] for i in
+        # range(200) are simply indexed by i in a (200, 100, 300) batch.
+        self._n_slices = n_slices
+        self._batch_shape = (n_slices, *self._input_shape_2d)
+        iterable_dirs = [ax for ax, doiter in enumerate(iterable_axes)
+                         if doiter]
+        self._perm = iterable_dirs + list(dirs)
+        self._inv_perm = [int(ax) for ax in np.argsort(self._perm)]
+        self._perm_dims = [dims[ax] for ax in self._perm]
+        # For matrix inputs, the column axis goes right after the iterable
+        # axes, so that all columns are transformed as a single batch
+        self._perm_mat = iterable_dirs + [ndim] + list(dirs)
+        self._inv_perm_mat = [int(ax) for ax in np.argsort(self._perm_mat)]
+        self._iterable_dims = [dims[ax] for ax in iterable_dirs]
+        # If dirs are the trailing axes in order, e.g., (-2, -1), no
+        # transposition is needed and each slice is already contiguous
+        self._trailing_contig = \
+            list(dirs) == list(range(ndim - len(dirs), ndim))
 
         # For a single 2d/3d input, the length of the vector will be given by
         # the shapes in FDCT.sizes
-        self._output_len = sum(np.prod(j) for i in self.FDCT.sizes for j in i)
+        self._output_len = sum(_prod(j) for i in self.FDCT.sizes for j in i)
 
         # Save some useful properties
         self.dims = dims
@@ -111,28 +181,107 @@ class FDCT(LinearOperator):
         self.nbangles_coarse = nbangles_coarse
         self.allcurvelets = allcurvelets
         self.cpx = cpx
+        self._cast_dtype = cast_dtype
+        self.copy = copy
+        self._x_scratch = None
+        self._y_scratch = None
+        self._inv_scratch = None
+        self._fwd_out = None
+        self._inv_out = None
 
         # Required by PyLops
-        self.shape = (ndim_iterable * self._output_len, np.prod(dims))
-        self.dtype = dtype
+        self.shape = (self._n_slices * self._output_len, _prod(dims))
         self.explicit = False
 
+    def _buffer(self, name, shape, dtype):
+        # Buffers cached under name are allocated on first use and reused
+        # by later calls
+        buf = getattr(self, name)
+        if buf is None or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            setattr(self, name, buf)
+        return buf
+
+    def _out_buffer(self, name, shape, dtype=None):
+        # Buffers are only reused with copy=False, so that by default an
+        # operator keeps no mutable state between calls. The batch of
+        # slices covers the whole input exactly once, so every element is
+        # overwritten and buffers need not be zeroed
+        dtype = self.dtype if dtype is None else dtype
+        if self.copy:
+            return np.empty(shape, dtype=dtype)
+        return self._buffer(name, shape, dtype)
+
+    def _to_batch(self, x):
+        # View x as a contiguous (n_slices, *input_shape_2d) batch. A copy
+        # is only made when it cannot be avoided (non-contiguous input,
+        # transposition or casting)
+        if self._cast_dtype is None and self._trailing_contig and \
+                x.flags.c_contiguous:
+            return x.reshape(self._batch_shape)
+        x_perm = x.reshape(self.dims).transpose(self._perm)
+        dtype = x.dtype if self._cast_dtype is None else self._cast_dtype
+        x_scratch = self._out_buffer('_x_scratch', self._perm_dims, dtype)
+        np.copyto(x_scratch, x_perm, casting='unsafe')
+        return x_scratch.reshape(self._batch_shape)
+
     def _matvec(self, x):
-        n = self._output_len
-        fwd_out = np.zeros(self.shape[0], dtype=self.dtype)
-        for i, index in enumerate(self._iterator):
-            fwd_out[i*n:(i+1)*n] = self.FDCT.fwd(x.reshape(self.dims)[index])
-        return fwd_out
+        # Each row holds the coefficients of a single slice
+        fwd_out = self._out_buffer('_fwd_out',
+                                   (self._n_slices, self._output_len))
+        _fwd_batch(self.FDCT, self._to_batch(x), fwd_out)
+        return fwd_out.ravel()
 
     def _rmatvec(self, x):
-        n = self._output_len
-        inv_out = np.zeros(self.dims, dtype=self.dtype)
-        for i, index in enumerate(self._iterator):
-            inv_out[index] = self.FDCT.inv(
-                x[i*n:(i+1)*n]).reshape(self._input_shape_2d)
+        x_batch = x.reshape(self._n_slices, self._output_len)
+        if self._cast_dtype is not None:
+            # Upcast as done for the forward input
+            y_scratch = self._out_buffer('_y_scratch', x_batch.shape,
+                                         self._cast_dtype)
+            np.copyto(y_scratch, x_batch, casting='unsafe')
+            x_batch = y_scratch
+        if self._trailing_contig:
+            inv_out = self._out_buffer('_inv_out', self._batch_shape)
+            _inv_batch(self.FDCT, x_batch, inv_out)
+            return inv_out.ravel()
 
+        # The slices have to be transposed back into the output buffer.
+        # The transposed view may itself be contiguous (e.g., when an
+        # iterable axis has size 1), so it is never returned directly
+        inv_batch = self._out_buffer('_inv_scratch', self._batch_shape)
+        _inv_batch(self.FDCT, x_batch, inv_batch)
+        inv_out = self._out_buffer('_inv_out', self.dims)
+        np.copyto(inv_out, inv_batch.reshape(self._perm_dims).transpose(
+            self._inv_perm))
         return inv_out.ravel()
 
+    def _matmat(self, X):
+        # Slices are ordered by (slice, column) in the batch
+        ncols = X.shape[1]
+        x_batch = np.ascontiguousarray(
+            X.reshape(*self.dims, ncols).transpose(self._perm_mat),
+            dtype=self._cast_dtype).reshape(
+                self._n_slices * ncols, *self._input_shape_2d)
+        fwd_out = np.empty((self._n_slices, ncols, self._output_len),
+                           dtype=self.dtype)
+        _fwd_batch(self.FDCT, x_batch, fwd_out.reshape(
+            self._n_slices * ncols, self._output_len))
+        return fwd_out.transpose(0, 2, 1).reshape(self.shape[0], ncols)
+
+    def _rmatmat(self, X):
+        ncols = X.shape[1]
+        x_batch = np.ascontiguousarray(
+            X.reshape(self._n_slices, self._output_len,
+                      ncols).transpose(0, 2, 1),
+            dtype=self._cast_dtype).reshape(
+                self._n_slices * ncols, self._output_len)
+        inv_out = np.empty((self._n_slices * ncols, *self._input_shape_2d),
+                           dtype=self.dtype)
+        _inv_batch(self.FDCT, x_batch, inv_out)
+        return inv_out.reshape(
+            *self._iterable_dims, ncols, *self._input_shape_2d).transpose(
+                self._inv_perm_mat).reshape(self.shape[1], ncols)
+
     def inverse(self, x):
         return self._rmatvec(x)
 
@@ -148,11 +297,12 @@ class FDCT2D(FDCT):
 
     def __init__(self, dims, dirs=(-2, -1),
                  nbscales=None, nbangles_coarse=16, allcurvelets=True,
-                 dtype='complex128'):
+                 dtype='complex128', copy=True):
         if len(dirs) != 2:
             raise ValueError(
                 "FDCT2D must be called with exactly two directions")
-        super().__init__(dims, dirs, nbscales, nbangles_coarse, allcurvelets, dtype)
+        self._build_plan(ct.fdct2, dims, dirs, nbscales, nbangles_coarse,
+                         allcurvelets, dtype, copy)
 
 
 class FDCT3D(FDCT):
@@ -160,8 +310,9 @@ class FDCT3D(FDCT):
 
     def __init__(self, dims, dirs=(-3, -2, -1),
                  nbscales=None, nbangles_coarse=16, allcurvelets=True,
-                 dtype='complex128'):
+                 dtype='complex128', copy=True):
         if len(dirs) != 3:
             raise ValueError(
                 "FDCT3D must be called with exactly three directions")
-        super().__init__(dims, dirs, nbscales, nbangles_coarse, allcurvelets, dtype)
+        self._build_plan(ct.fdct3, dims, dirs, nbscales, nbangles_coarse,
+                         allcurvelets, dtype, copy)
@@ -142,3 +142,133 @@ def test_FDCT3D_4dsignal(par):
         x_ct[:, i, :, :] = FDCTct.inv(y_op[i*n:(i+1)*n])
     np.testing.assert_array_almost_equal(x_op, x_ct, decimal=64)
     assert x_op.dtype == x_ct.dtype
+
+
+@pytest.mark.parametrize("par", pars)
+def test_FDCT2D_single(par):
+    """
+    Tests that single precision FDCT2D matches double precision.
+    """
+    x = np.random.normal(0., 1., (par['nx'], par['ny'], par['nz'])) + \
+        np.random.normal(0., 1., (par['nx'], par['ny'], par['nz'])) * \
+        par['imag']
+    dtype_single = 'float32' if par['imag'] == 0 else 'complex64'
+    FDCTdbl = FDCT2D(dims=x.shape, dtype=par['dtype'])
+    FDCTsgl = FDCT2D(dims=x.shape, dtype=dtype_single)
+
+    y_dbl = FDCTdbl * x.ravel()
+    y_sgl = FDCTsgl * x.ravel().astype(dtype_single)
+    assert y_sgl.dtype == np.dtype(dtype_single)
+    assert np.linalg.norm(y_sgl - y_dbl) < 1e-5 * np.linalg.norm(y_dbl)
+
+    x_dbl = FDCTdbl.H * y_dbl
+    x_sgl = FDCTsgl.H * y_sgl
+    assert x_sgl.dtype == np.dtype(dtype_single)
+    assert FDCTsgl._y_scratch is None
+    assert np.linalg.norm(x_sgl - x_dbl) < 1e-5 * np.linalg.norm(x_dbl)
+
+
+@pytest.mark.parametrize("par", pars)
+def test_FDCT2D_noncontiguous(par):
+    """
+    Tests FDCT2D with non-contiguous input and repeated calls.
+    """
+    dims = (par['nx'], par['ny'], par['nz'])
+    x = np.random.normal(0., 1., 2 * np.prod(dims)) + \
+        np.random.normal(0., 1., 2 * np.prod(dims)) * par['imag']
+    x_strided = x[::2]
+    x_contig = np.ascontiguousarray(x_strided)
+    for dirs in [(0, -1), (-2, -1)]:
+        FDCTop = FDCT2D(dims=dims, dirs=dirs, dtype=par['dtype'])
+        y_contig = FDCTop * x_contig
+        y_strided = FDCTop * x_strided
+        np.testing.assert_array_equal(y_strided, y_contig)
+
+        # Results of previous calls must not be overwritten
+        x_inv = FDCTop.H * y_contig
+        x_inv2 = FDCTop.H * (2 * y_contig)
+        np.testing.assert_array_equal(2 * x_inv, x_inv2)
+
+        # With copy=True no buffers are kept between calls
+        assert FDCTop._x_scratch is None
+        assert FDCTop._inv_scratch is None
+
+    # Size-1 iterable axes make the transposed scratch buffer contiguous
+    for dims, dirs in [((par['nx'], par['nz'], 1), (0, 1)),
+                       ((par['nx'], 1, par['nz']), (0, 2))]:
+        FDCTop = FDCT2D(dims=dims, dirs=dirs, dtype=par['dtype'])
+        y = FDCTop * x[:np.prod(dims)]
+        x_inv = FDCTop.H * y
+        x_inv_ref = x_inv.copy()
+        x_inv2 = FDCTop.H * (2 * y)
+        assert not np.shares_memory(x_inv, x_inv2)
+        np.testing.assert_array_equal(x_inv, x_inv_ref)
+
+
+def test_FDCT_dirs():
+    """
+    Tests validation of FDCT directions.
+    """
+    FDCTop = FDCT2D(dims=(32, 4, 32), dirs=(0, -1))
+    assert FDCTop.dirs == [0, 2]
+    with pytest.raises(ValueError):
+        FDCT2D(dims=(32, 4, 32), dirs=(0, 3))
+    with pytest.raises(ValueError):
+        FDCT2D(dims=(32, 4, 32), dirs=(-1, 2))
+
+
+@pytest.mark.parametrize("par", pars)
+def test_FDCT2D_nocopy(par):
+    """
+    Tests FDCT2D reusing its output buffers.
+    """
+    x = np.random.normal(0., 1., (par['nx'], par['ny'], par['nz'])) + \
+        np.random.normal(0., 1., (par['nx'], par['ny'], par['nz'])) * \
+        par['imag']
+    for dirs in [(0, -1), (-2, -1)]:
+        FDCTcopy = FDCT2D(dims=x.shape, dirs=dirs, dtype=par['dtype'])
+        FDCTop = FDCT2D(dims=x.shape, dirs=dirs, dtype=par['dtype'],
+                        copy=False)
+        y_copy = FDCTcopy * x.ravel()
+        y_op = FDCTop * x.ravel()
+        np.testing.assert_array_equal(y_op, y_copy)
+        assert np.shares_memory(y_op, FDCTop * x.ravel())
+
+        x_copy = FDCTcopy.H * y_copy
+        x_op = FDCTop.H * y_copy
+        np.testing.assert_array_equal(x_op, x_copy)
+        assert np.shares_memory(x_op, FDCTop.H * y_copy)
+
+
+def test_FDCT_plan_cache():
+    """
+    Tests that operators with the same configuration share their plans.
+    """
+    FDCTop1 = FDCT2D(dims=(32, 4, 32), dirs=(0, -1))
+    FDCTop2 = FDCT2D(dims=(32, 4, 32), dirs=(0, -1))
+    FDCTop3 = FDCT2D(dims=(32, 4, 32), dirs=(0, -1), dtype='float64')
+    assert FDCTop1.FDCT is FDCTop2.FDCT
+    assert FDCTop1.FDCT is not FDCTop3.FDCT
+
+
+@pytest.mark.parametrize("par", pars)
+def test_FDCT2D_matmat(par):
+    """
+    Tests FDCT2D applied to a block of signals.
+    """
+    dims = (par['nx'], par['ny'], par['nz'])
+    X = np.random.normal(0., 1., (np.prod(dims), 3)) + \
+        np.random.normal(0., 1., (np.prod(dims), 3)) * par['imag']
+    for dirs in [(0, -1), (-2, -1)]:
+        FDCTop = FDCT2D(dims=dims, dirs=dirs, dtype=par['dtype'])
+        Y = FDCTop.matmat(X)
+        Y_cols = np.stack([FDCTop.matvec(X[:, k]) for k in range(3)],
+                          axis=1)
+        np.testing.assert_array_equal(Y, Y_cols)
+        assert Y.dtype == Y_cols.dtype
+
+        X_inv = FDCTop.rmatmat(Y)
+        X_cols = np.stack([FDCTop.rmatvec(Y[:, k]) for k in range(3)],
+                          axis=1)
+        np.testing.assert_array_equal(X_inv, X_cols)
+        assert X_inv.dtype == X_cols.dtype